@@ -0,0 +1,155 @@
+"""Compare per-message overhead of the forwarder -> bot server transports.
+
+Each transport hands the same payload to a no-op handler, so the numbers only
+cover encoding, the hop itself and decoding -- not the Telegram API calls.
+Every timing runs until the handler has finished with the last message, so
+the socket and local transports (which hand off before handling) are
+measured on the same terms as HTTP (which replies after handling).
+
+    python benchmark_transport.py --messages 500 --media-kb 256
+"""
+import os
+import time
+import base64
+import asyncio
+import argparse
+import tempfile
+import threading
+
+import requests
+from transport import UnixSocketSender, UnixSocketServer
+
+SECRET_KEY = "bench_secret"
+
+
+def make_payload(media_kb):
+    payload = {
+        "text": "Bitcoin ETF sees record inflows " * 4,
+        "source_tag": "Source: Benchmark",
+        "media_bytes": None,
+        "media_filename": None,
+        "media_type": None,
+        "album": False,
+    }
+    if media_kb:
+        payload["media_bytes"] = os.urandom(media_kb * 1024)
+        payload["media_filename"] = "bench.jpg"
+        payload["media_type"] = "MessageMediaPhoto"
+    return payload
+
+
+def consume(data):
+    # Stand-in for bot_server.process_forward: just touch the media bytes
+    media = data.get("media_bytes")
+    if media:
+        media = media if isinstance(media, bytes) else base64.b64decode(media)
+    return len(media or b"")
+
+
+def bench_http(payload, n, port=8765):
+    from fastapi import FastAPI, Request
+    import uvicorn
+
+    app = FastAPI()
+
+    @app.post("/forward")
+    async def forward(request: Request):
+        data = await request.json()
+        if data.get("secret_key") != SECRET_KEY:
+            return {"status": "unauthorized"}
+        consume(data)
+        return {"status": "ok"}
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if not thread.is_alive() or time.monotonic() > deadline:
+            server.should_exit = True
+            raise RuntimeError(f"uvicorn did not start on port {port} (port in use?)")
+        time.sleep(0.05)
+
+    url = f"http://127.0.0.1:{port}/forward"
+    session = requests.Session()
+    start = time.perf_counter()
+    for _ in range(n):
+        # Same encoding as forwarder.post_to_bot_server
+        body = dict(payload, secret_key=SECRET_KEY)
+        if isinstance(body.get("media_bytes"), bytes):
+            body["media_bytes"] = base64.b64encode(body["media_bytes"]).decode('utf-8')
+        session.post(url, json=body, timeout=30)
+    elapsed = time.perf_counter() - start
+    server.should_exit = True
+    thread.join()
+    return elapsed
+
+
+async def bench_unix(payload, n):
+    path = os.path.join(tempfile.mkdtemp(), "bench.sock")
+
+    handled = 0
+    all_handled = asyncio.Event()
+
+    async def handler(data):
+        nonlocal handled
+        consume(data)
+        handled += 1
+        if handled == n:
+            all_handled.set()
+
+    server = UnixSocketServer(path, handler)
+    await server.start()
+    sender = UnixSocketSender(path)
+    start = time.perf_counter()
+    for _ in range(n):
+        await sender.send(payload)
+    await all_handled.wait()
+    elapsed = time.perf_counter() - start
+    sender.close()
+    await server.close()
+    return elapsed
+
+
+async def bench_local(payload, n):
+    queue = asyncio.Queue()
+
+    async def consumer():
+        while True:
+            consume(await queue.get())
+            queue.task_done()
+
+    task = asyncio.create_task(consumer())
+    start = time.perf_counter()
+    for _ in range(n):
+        await queue.put(payload)
+    await queue.join()
+    elapsed = time.perf_counter() - start
+    task.cancel()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--media-kb", type=int, default=0, help="attach a media file of this size")
+    parser.add_argument("--transports", default="http,unix,local")
+    args = parser.parse_args()
+
+    payload = make_payload(args.media_kb)
+    print(f"{args.messages} messages, media {args.media_kb} KB")
+    for name in [t.strip() for t in args.transports.split(",") if t.strip()]:
+        if name == "http":
+            elapsed = bench_http(payload, args.messages)
+        elif name == "unix":
+            elapsed = asyncio.run(bench_unix(payload, args.messages))
+        elif name == "local":
+            elapsed = asyncio.run(bench_local(payload, args.messages))
+        else:
+            print(f"[SKIP] Unknown transport {name}")
+            continue
+        print(f"{name:>6}: {elapsed / args.messages * 1e6:10.1f} us/msg  ({args.messages / elapsed:9.0f} msg/s)")
+
+
+if __name__ == "__main__":
+    main()
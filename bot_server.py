@@ -1,5 +1,6 @@
 import os
 import json
+import asyncio
 from fastapi import FastAPI, Request
 from telegram import Bot, InputMediaPhoto, InputMediaDocument, InputMediaVideo, InputMediaAudio
 from telegram.error import TelegramError
@@ -7,16 +8,23 @@ from dotenv import load_dotenv
 import base64
 import tempfile
 import requests
+from transport import UnixSocketServer, DEFAULT_SOCKET
 
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 SECRET_KEY = os.getenv("FORWARD_SECRET", "my_super_secret")
 ADMIN_CHAT_ID = os.getenv("ADMIN_CHAT_ID")  # User ID or log channel ID
+# Also serve a Unix socket when the forwarder is set up to use one
+FORWARD_TRANSPORT = os.getenv("FORWARD_TRANSPORT", "http").lower()
+FORWARD_SOCKET = os.getenv("FORWARD_SOCKET")
+SERVE_SOCKET = FORWARD_TRANSPORT == "unix" or bool(FORWARD_SOCKET)
+FORWARD_SOCKET = FORWARD_SOCKET or DEFAULT_SOCKET
 
 MAX_SIZE = 45 * 1024 * 1024  # 45 MB
 bot = Bot(BOT_TOKEN)
 app = FastAPI()
 DEST_CHANNELS = []
+socket_server = None
 
 def notify_admin(text):
     """Send error or log to admin/log channel."""
@@ -34,6 +42,10 @@ def notify_admin(text):
     except Exception as e:
         print(f"[DM ADMIN ERROR] {e}")
 
+async def notify_admin_async(text):
+    """notify_admin off the event loop, so a slow Bot API call never stalls forwarding."""
+    await asyncio.get_running_loop().run_in_executor(None, notify_admin, text)
+
 def load_dest_channels():
     try:
         with open("config.json", "r") as f:
@@ -70,7 +82,7 @@ async def resolve_dest_channels(bot, dest_channels):
                 updated = True
             except TelegramError as e:
                 print(f"[BOT ERROR] Could not resolve @{uname}: {e}")
-                notify_admin(f"⚠️ [BotServer] Could not resolve @{uname}: {e}")
+                await notify_admin_async(f"⚠️ [BotServer] Could not resolve @{uname}: {e}")
     if updated:
         try:
             with open("config.json", "r") as f:
@@ -80,18 +92,62 @@ async def resolve_dest_channels(bot, dest_channels):
                 json.dump(config, f, indent=2)
         except Exception as e:
             print(f"[BOT ERROR] Failed to update config.json: {e}")
-            notify_admin(f"⚠️ [BotServer] Failed to update config.json: {e}")
+            await notify_admin_async(f"⚠️ [BotServer] Failed to update config.json: {e}")
     return [c["id"] for c in resolved if c.get("id")]
 
-@app.on_event("startup")
-async def startup_event():
-    global DEST_CHANNELS
+async def refresh_dest_channels():
     print("[BOT] Loading destination channels from config.json...")
     dest_objs = load_dest_channels()
-    DEST_CHANNELS.clear()
-    DEST_CHANNELS.extend(await resolve_dest_channels(bot, dest_objs))
+    # Swap in one step so messages in flight never see an empty list
+    DEST_CHANNELS[:] = await resolve_dest_channels(bot, dest_objs)
     print(f"[BOT] Final destination channel IDs: {DEST_CHANNELS}")
 
+@app.on_event("startup")
+async def startup_event():
+    await refresh_dest_channels()
+
+@app.on_event("startup")
+async def start_socket_server():
+    global socket_server
+    if SERVE_SOCKET:
+        socket_server = UnixSocketServer(FORWARD_SOCKET, process_forward)
+        await socket_server.start()
+        print(f"[BOT] Listening for forwarder on unix socket {FORWARD_SOCKET}")
+
+@app.on_event("shutdown")
+async def stop_socket_server():
+    if socket_server:
+        dropped = await socket_server.close()
+        if dropped:
+            warn = f"⚠️ [BotServer] Shut down with {dropped} queued socket message(s) not posted."
+            print(warn)
+            await notify_admin_async(warn)
+
+async def consume_queue(queue):
+    """Single-process mode: payloads are handed over by forwarder.py in-process."""
+    while True:
+        data = await queue.get()
+        try:
+            await process_forward(data)
+        except Exception as e:
+            print(f"[BOT ERROR] {e}")
+            await notify_admin_async(f"⚠️ [BotServer Error]\n{e}")
+        finally:
+            queue.task_done()
+
+def decode_media(value):
+    # base64 over HTTP, raw bytes over the socket and local queue
+    return value if isinstance(value, bytes) else base64.b64decode(value)
+
+def summarize_payload(data):
+    """Payload for logging, with media replaced by sizes and the secret left out."""
+    summary = {k: v for k, v in data.items() if k not in ("media_bytes", "media_bytes_list", "secret_key")}
+    if data.get("media_bytes"):
+        summary["media_bytes"] = f"<{len(data['media_bytes'])} bytes>"
+    if data.get("media_bytes_list"):
+        summary["media_bytes_list"] = [f"<{len(b)} bytes>" for b in data["media_bytes_list"]]
+    return str(summary)
+
 def cleanup_files(file_list):
     for fp in file_list:
         try:
@@ -106,10 +162,13 @@ async def forward(request: Request):
     # --- SECRET KEY CHECK ---
     if data.get("secret_key") != SECRET_KEY:
         print("[SECURITY] Wrong secret key in /forward!")
-        notify_admin("🚨 [BotServer] Unauthorized forward attempt!")
+        await notify_admin_async("🚨 [BotServer] Unauthorized forward attempt!")
         return {"status": "unauthorized"}
 
-    print(f"[BOT DEBUG] Data received: {str(data)[:350]}")
+    return await process_forward(data)
+
+async def process_forward(data):
+    print(f"[BOT DEBUG] Data received: {summarize_payload(data)[:350]}")
     text = data.get("text", "")
     tag = data.get("source_tag", "")
     caption = f"{text}\n\n{tag}".strip() if tag else text
@@ -123,19 +182,24 @@ async def forward(request: Request):
     media_bytes_list = data.get("media_bytes_list")
     media_filename_list = data.get("media_filename_list")
     media_type_list = data.get("media_type_list")
+    # Routing: destinations with rules only get messages their rules matched
+    ruled_dests = set(data.get("ruled_dests") or [])
+    matched_dests = set(data.get("matched_dests") or [])
 
     for dest_id in DEST_CHANNELS:
+        if str(dest_id) in ruled_dests and str(dest_id) not in matched_dests:
+            continue
         try:
             # ---- ALBUM (MEDIA GROUP) ----
             if album and media_bytes_list and media_type_list:
                 media_group = []
                 temp_files = []
                 for idx, (file_b64, fname, typ) in enumerate(zip(media_bytes_list, media_filename_list, media_type_list)):
-                    file_bytes = base64.b64decode(file_b64)
+                    file_bytes = decode_media(file_b64)
                     if len(file_bytes) > MAX_SIZE:
                         warn = f"[BOT ERROR] Album file {fname} too large, skipping."
                         print(warn)
-                        notify_admin(warn)
+                        await notify_admin_async(warn)
                         continue
                     with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(fname)[1]) as tf:
                         tf.write(file_bytes)
@@ -155,11 +219,11 @@ async def forward(request: Request):
                 cleanup_files(temp_files)
             # ---- SINGLE MEDIA ----
             elif media_bytes and media_filename and media_type:
-                file_bytes = base64.b64decode(media_bytes)
+                file_bytes = decode_media(media_bytes)
                 if len(file_bytes) > MAX_SIZE:
                     warn = f"[BOT ERROR] Single file {media_filename} too large, skipping."
                     print(warn)
-                    notify_admin(warn)
+                    await notify_admin_async(warn)
                     continue
                 with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(media_filename)[1]) as tf:
                     tf.write(file_bytes)
@@ -184,7 +248,7 @@ async def forward(request: Request):
             tb = traceback.format_exc()
             print(f"[BOT ERROR] {e}")
             print(tb)
-            notify_admin(f"⚠️ [BotServer Error]\nDest: {dest_id}\n{e}\n{tb[:1000]}")
+            await notify_admin_async(f"⚠️ [BotServer Error]\nDest: {dest_id}\n{e}\n{tb[:1000]}")
     return {"status": "ok"}
 
 # To run: uvicorn bot_server:app --host 0.0.0.0 --port 8000
\ No newline at end of file
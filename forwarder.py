@@ -10,6 +10,8 @@ from telethon.errors import FloodWaitError
 from dotenv import load_dotenv
 from collections import defaultdict
 import base64
+from routing import RouteIndex
+from transport import UnixSocketSender, DEFAULT_SOCKET
 
 CONFIG_FILE = "config.json"
 MEDIA_DIR = "media"
@@ -21,6 +23,8 @@ api_id = int(os.getenv("API_ID"))
 api_hash = os.getenv("API_HASH")
 FORWARD_URL = os.getenv("FORWARD_URL", "http://localhost:8000/forward")
 SECRET_KEY = os.getenv("FORWARD_SECRET", "my_super_secret")
+FORWARD_TRANSPORT = os.getenv("FORWARD_TRANSPORT", "http").lower()  # http | unix | local
+FORWARD_SOCKET = os.getenv("FORWARD_SOCKET") or DEFAULT_SOCKET
 default_admin = int(os.getenv("ADMIN_ID", "6100298605"))
 
 logging.basicConfig(level=logging.WARNING, format='[%(asctime)s] %(levelname)s: %(message)s')
@@ -39,6 +43,9 @@ for f in os.listdir(MEDIA_DIR):
 
 client = TelegramClient('sessions/forwarder_session', api_id, api_hash)
 forwarding_enabled = True
+socket_sender = UnixSocketSender(FORWARD_SOCKET) if FORWARD_TRANSPORT == "unix" else None
+local_queue = None  # created in main() for FORWARD_TRANSPORT=local
+bot_server = None  # imported in main() for FORWARD_TRANSPORT=local
 
 def get_full_channel_id(entity):
     eid = int(entity.id)
@@ -63,33 +70,98 @@ def load_config():
                             dests.append({"id": None, "username": d.lstrip("@")})
                 admin_ids = set(int(x) for x in data.get("admin_ids", [default_admin]))
                 show_source = data.get("show_source", True)
+                routing_rules = []
+                raw_rules = data.get("routing_rules", [])
+                for r in raw_rules if isinstance(raw_rules, list) else []:
+                    # Rules without a usable dest can't fail closed, so they are dropped;
+                    # other malformed rules are kept and never match (see RouteIndex)
+                    if not isinstance(r, dict) or RouteIndex.validate_rule(r) == "dest must be a channel id":
+                        logging.error(f"Skipping malformed routing rule: {r!r}")
+                        continue
+                    routing_rules.append(dict(r))
+                # Hand-edited rules may lack an id (or reuse one); give them fresh ones
+                seen = set()
+                next_id = max((r["id"] for r in routing_rules if isinstance(r.get("id"), int)), default=0) + 1
+                for r in routing_rules:
+                    if not isinstance(r.get("id"), int) or r["id"] in seen:
+                        r["id"] = next_id
+                        next_id += 1
+                    seen.add(r["id"])
                 return (
                     sources,
                     dests,
                     admin_ids,
-                    show_source
+                    show_source,
+                    routing_rules
                 )
         except Exception as e:
             logging.error(f"Failed to load config: {e}")
-    return [], [], set([default_admin]), True
+    return [], [], set([default_admin]), True, []
 
-def save_config(source_channels, destination_channels, admin_ids, show_source):
+def save_config(source_channels, destination_channels, admin_ids, show_source, routing_rules):
     try:
         with open(CONFIG_FILE, "w") as f:
             json.dump({
                 "source_channels": [dict(x) for x in source_channels],
                 "destination_channels": destination_channels,
                 "admin_ids": list(admin_ids),
-                "show_source": show_source
+                "show_source": show_source,
+                "routing_rules": routing_rules
             }, f, indent=2)
     except Exception as e:
         logging.error(f"Failed to save config: {e}")
 
-source_channels, destination_channels, admin_ids, show_source = load_config()
+source_channels, destination_channels, admin_ids, show_source, routing_rules = load_config()
+route_index = RouteIndex()
+route_index.sync(routing_rules)
 
 def reload_config():
-    global source_channels, destination_channels, admin_ids, show_source
-    source_channels, destination_channels, admin_ids, show_source = load_config()
+    global source_channels, destination_channels, admin_ids, show_source, routing_rules
+    source_channels, destination_channels, admin_ids, show_source, routing_rules = load_config()
+    route_index.sync(routing_rules)
+    if bot_server:
+        # Single-process mode: the sender must see /adddest etc. without a restart
+        asyncio.get_running_loop().create_task(bot_server.refresh_dest_channels())
+
+def prune_routing_rules(rules):
+    """Drop rules whose destination is gone and forget removed source ids.
+
+    A rule that was limited to sources which have all been removed is dropped
+    too, rather than widened to match every source.
+    """
+    dest_ids = {str(d.get("id")) for d in destination_channels}
+    source_ids = {str(sc['id']) for sc in source_channels}
+    pruned = []
+    for r in rules:
+        if str(r.get("dest")) not in dest_ids:
+            continue
+        if r.get("sources") and isinstance(r["sources"], list):
+            sources = [s for s in r["sources"] if str(s) in source_ids]
+            if not sources:
+                continue
+            r = dict(r, sources=sources)
+        pruned.append(r)
+    return pruned
+
+def split_from_clause(text):
+    """Split an optional trailing "from src1,src2" off a route command.
+
+    The clause only counts when every name is a known source, so keyword text
+    like "made from scratch" is left alone.
+    """
+    m = re.match(r'(?is)^(.*\S)\s+from\s+(\S.*)$', text)
+    if not m:
+        return text, []
+    ids = []
+    for name in (x.strip().lstrip("@") for x in m.group(2).split(",") if x.strip()):
+        sc = next((
+            sc for sc in source_channels
+            if str(sc['id']) == name or (sc.get('username') and sc.get('username').lower() == name.lower())
+        ), None)
+        if not sc:
+            return text, []
+        ids.append(str(sc['id']))
+    return m.group(1), ids
 
 def remove_mentions(text):
     if not text:
@@ -105,6 +177,16 @@ def remove_mentions(text):
 def is_channel_allowed(cid):
     return any(str(cid) == str(sc['id']) for sc in source_channels)
 
+def route_message(cid, clean_caption):
+    """Return routing fields for the payload, or None if no destination wants it."""
+    ruled = route_index.ruled_dests
+    if not ruled:
+        return {}
+    matched = route_index.match(cid, clean_caption)
+    if not any(str(d.get("id")) not in ruled or str(d.get("id")) in matched for d in destination_channels):
+        return None
+    return {"ruled_dests": sorted(ruled), "matched_dests": sorted(matched)}
+
 album_buffer = defaultdict(list)
 album_last_seen = {}
 
@@ -115,8 +197,13 @@ async def notify_admin_async(text):
         except Exception:
             pass
 
-def send_to_bot_server(payload):
-    payload["secret_key"] = SECRET_KEY
+def post_to_bot_server(payload):
+    payload = dict(payload, secret_key=SECRET_KEY)
+    # Only the HTTP transport needs media as base64 inside the JSON body
+    if isinstance(payload.get("media_bytes"), bytes):
+        payload["media_bytes"] = base64.b64encode(payload["media_bytes"]).decode('utf-8')
+    if payload.get("media_bytes_list"):
+        payload["media_bytes_list"] = [base64.b64encode(b).decode('utf-8') for b in payload["media_bytes_list"]]
     for attempt in range(3):
         try:
             requests.post(FORWARD_URL, json=payload, timeout=30)
@@ -130,6 +217,24 @@ def send_to_bot_server(payload):
             notify_admin_async("⚠️ [Forwarder ERROR] Failed to POST message to bot server after 3 tries.")
         )
 
+async def send_to_bot_server(payload):
+    if FORWARD_TRANSPORT == "local":
+        await local_queue.put(payload)
+        print(f"[FORWARDED] {payload['text'][:40]}... to local queue.")
+        return
+    if FORWARD_TRANSPORT == "unix":
+        for attempt in range(3):
+            try:
+                await socket_sender.send(payload)
+                print(f"[FORWARDED] {payload['text'][:40]}... to bot server socket.")
+                return
+            except Exception as e:
+                logging.error(f"[HYBRID_ERROR] Failed to send over {FORWARD_SOCKET}: {e}")
+                await asyncio.sleep(2)
+        await notify_admin_async("⚠️ [Forwarder ERROR] Failed to send message to bot server socket after 3 tries.")
+        return
+    post_to_bot_server(payload)
+
 @client.on(events.NewMessage)
 async def forward_message(event):
     global forwarding_enabled, show_source
@@ -149,11 +254,15 @@ async def forward_message(event):
         tag = f"Source: {source_name}"
         if message.grouped_id:
             group_id = (event.chat_id, message.grouped_id)
-            album_buffer[group_id].append((event, tag))
+            album_buffer[group_id].append((event, tag, cid))
             album_last_seen[group_id] = time.time()
             asyncio.create_task(debounce_album_send(group_id))
         else:
             clean_caption = remove_mentions(message.text) if message.text else ""
+            routes = route_message(cid, clean_caption)
+            if routes is None:
+                print(f"[SKIP] No routing rule matched message from {uname or cid}.")
+                return
             caption_with_source = f"{clean_caption}\n\n{tag}".strip() if show_source else clean_caption
             payload = {
                 "text": clean_caption,
@@ -164,6 +273,7 @@ async def forward_message(event):
                 "caption": caption_with_source,
                 "album": False
             }
+            payload.update(routes)
             if message.media:
                 file_path = await message.download_media(file=MEDIA_DIR + "/")
                 if os.path.getsize(file_path) > MAX_SIZE:
@@ -173,13 +283,11 @@ async def forward_message(event):
                     os.remove(file_path)
                     return
                 with open(file_path, "rb") as f:
-                    file_bytes = f.read()
-                    file_b64 = base64.b64encode(file_bytes).decode('utf-8')
-                payload["media_bytes"] = file_b64
+                    payload["media_bytes"] = f.read()
                 payload["media_filename"] = os.path.basename(file_path)
                 payload["media_type"] = type(message.media).__name__
                 os.remove(file_path)
-            send_to_bot_server(payload)
+            await send_to_bot_server(payload)
     except FloodWaitError as e:
         await asyncio.sleep(e.seconds)
         await forward_message(event)
@@ -201,13 +309,18 @@ async def process_album(group_id):
         return
     events_group.sort(key=lambda x: x[0].message.id)
     tag = events_group[0][1]
+    cid = events_group[0][2]
     clean_caption = remove_mentions(events_group[0][0].message.text) if events_group[0][0].message.text else ""
+    routes = route_message(cid, clean_caption)
+    if routes is None:
+        print(f"[SKIP] No routing rule matched album from {cid}.")
+        return
     caption_with_source = f"{clean_caption}\n\n{tag}".strip() if show_source else clean_caption
 
-    file_b64s = []
+    file_blobs = []
     file_names = []
     media_types = []
-    for e, _ in events_group:
+    for e, _, _ in events_group:
         if e.message.media:
             fp = await e.message.download_media(file=MEDIA_DIR + "/")
             if os.path.getsize(fp) > MAX_SIZE:
@@ -217,27 +330,27 @@ async def process_album(group_id):
                 os.remove(fp)
                 continue
             with open(fp, "rb") as f:
-                file_bytes = f.read()
-                file_b64s.append(base64.b64encode(file_bytes).decode('utf-8'))
+                file_blobs.append(f.read())
                 file_names.append(os.path.basename(fp))
                 media_types.append(type(e.message.media).__name__)
             os.remove(fp)
-    if not file_b64s:
+    if not file_blobs:
         return
     payload = {
         "text": clean_caption,
         "source_tag": tag if show_source else "",
-        "media_bytes_list": file_b64s,
+        "media_bytes_list": file_blobs,
         "media_filename_list": file_names,
         "media_type_list": media_types,
         "caption": caption_with_source,
         "album": True,
     }
-    send_to_bot_server(payload)
+    payload.update(routes)
+    await send_to_bot_server(payload)
 
 @client.on(events.NewMessage(pattern=r'^/'))
 async def admin_commands(event):
-    global forwarding_enabled, source_channels, destination_channels, admin_ids, show_source
+    global forwarding_enabled, source_channels, destination_channels, admin_ids, show_source, routing_rules
     sender = int(event.sender_id)
     cmd = event.raw_text.strip()
 
@@ -255,7 +368,7 @@ async def admin_commands(event):
                 await event.reply(f"Channel {resolved_username or resolved_id} already in destination list.")
                 return
             destination_channels.append({"id": resolved_id, "username": resolved_username or ch})
-            save_config(source_channels, destination_channels, admin_ids, show_source)
+            save_config(source_channels, destination_channels, admin_ids, show_source, routing_rules)
             reload_config()
             await event.reply(f"✅ Added destination: {resolved_username or resolved_id} (ID: {resolved_id}, Title: {resolved_title}) (Saved to config.json!)")
         except Exception as e:
@@ -270,7 +383,8 @@ async def admin_commands(event):
             if not (str(d.get("id")) == ch or (d.get("username") and d.get("username").lower() == ch.lower()))
         ]
         if len(destination_channels) < before:
-            save_config(source_channels, destination_channels, admin_ids, show_source)
+            routing_rules = prune_routing_rules(routing_rules)
+            save_config(source_channels, destination_channels, admin_ids, show_source, routing_rules)
             reload_config()
             await event.reply(f"✅ Removed destination: {ch} (Saved to config.json!)")
         else:
@@ -289,7 +403,8 @@ async def admin_commands(event):
             except Exception:
                 continue
         destination_channels[:] = newdests
-        save_config(source_channels, destination_channels, admin_ids, show_source)
+        routing_rules = prune_routing_rules(routing_rules)
+        save_config(source_channels, destination_channels, admin_ids, show_source, routing_rules)
         reload_config()
         await event.reply(
             "✅ Destination channels set to: " +
@@ -297,6 +412,76 @@ async def admin_commands(event):
         )
         return
 
+    if cmd.startswith("/addroute ") or cmd.startswith("/addregex "):
+        parts = cmd.split(maxsplit=2)
+        if len(parts) < 3:
+            await event.reply("❌ Usage: /addroute <dest> <kw1,kw2,...|*> [from src1,src2]  or  /addregex <dest> <pattern> [from src1,src2]")
+            return
+        ch = parts[1].strip().lstrip("@")
+        dest = next((
+            d for d in destination_channels
+            if str(d.get("id")) == ch or (d.get("username") and d.get("username").lower() == ch.lower())
+        ), None)
+        if not dest or not dest.get("id"):
+            await event.reply(f"Channel {ch} not found in destination list. Add it with /adddest first.")
+            return
+        rule = {"id": max((r.get("id", 0) for r in routing_rules), default=0) + 1, "dest": str(dest["id"]), "sources": [], "keywords": [], "regex": []}
+        rest, rule["sources"] = split_from_clause(parts[2])
+        if parts[0] == "/addregex":
+            try:
+                re.compile(rest)
+            except re.error as e:
+                await event.reply(f"❌ Invalid regex: {e}")
+                return
+            rule["regex"] = [rest]
+        elif rest.strip() != "*":
+            rule["keywords"] = [k.strip().lower() for k in rest.split(",") if k.strip()]
+        if not (rule["keywords"] or rule["regex"] or rule["sources"]):
+            await event.reply("❌ A route needs keywords, a regex or a source.")
+            return
+        routing_rules.append(rule)
+        save_config(source_channels, destination_channels, admin_ids, show_source, routing_rules)
+        reload_config()
+        await event.reply(
+            f"✅ Added route #{rule['id']} -> {dest.get('username') or dest['id']}: "
+            f"{', '.join(rule['keywords']) or ' '.join(f'/{p}/' for p in rule['regex']) or '*'}"
+            + (f" (from {', '.join(rule['sources'])})" if rule["sources"] else "")
+            + " (Saved to config.json!)"
+        )
+        return
+
+    if cmd.startswith("/removeroute "):
+        rid = cmd.split(maxsplit=1)[1].strip().lstrip("#")
+        before = len(routing_rules)
+        routing_rules = [r for r in routing_rules if str(r.get("id")) != rid]
+        if len(routing_rules) < before:
+            save_config(source_channels, destination_channels, admin_ids, show_source, routing_rules)
+            reload_config()
+            await event.reply(f"✅ Removed route #{rid} (Saved to config.json!)")
+        else:
+            await event.reply(f"Route #{rid} not found. Use /routes to list them.")
+        return
+
+    if cmd == "/routes":
+        if not routing_rules:
+            await event.reply("No routing rules. Every message goes to every destination.")
+            return
+        lines = []
+        for r in routing_rules:
+            error = RouteIndex.validate_rule(r)
+            if error:
+                lines.append(f"#{r.get('id')} -> {r.get('dest')}: invalid, never matches ({error})")
+                continue
+            match = ", ".join(r.get("keywords") or []) or ""
+            if r.get("regex"):
+                match = (match + " " if match else "") + " ".join(f"/{p}/" for p in r["regex"])
+            lines.append(
+                f"#{r.get('id')} -> {r.get('dest')}: {match or '*'}"
+                + (f" (from {', '.join(r['sources'])})" if r.get("sources") else "")
+            )
+        await event.reply("Routes:\n" + "\n".join(lines))
+        return
+
     if cmd.startswith("/addsource "):
         ch = cmd.split(maxsplit=1)[1].strip().lstrip("@")
         try:
@@ -308,7 +493,7 @@ async def admin_commands(event):
                 await event.reply(f"Channel {resolved_username or resolved_id} already in the source list.")
             else:
                 source_channels.append({'id': resolved_id, 'username': resolved_username})
-                save_config(source_channels, destination_channels, admin_ids, show_source)
+                save_config(source_channels, destination_channels, admin_ids, show_source, routing_rules)
                 reload_config()
                 await event.reply(f"✅ Added source: {resolved_username or resolved_id} (ID: {resolved_id}, Title: {resolved_title}) (Saved to config.json!)")
         except Exception as e:
@@ -327,7 +512,8 @@ async def admin_commands(event):
             )
         ]
         if len(source_channels) < before:
-            save_config(source_channels, destination_channels, admin_ids, show_source)
+            routing_rules = prune_routing_rules(routing_rules)
+            save_config(source_channels, destination_channels, admin_ids, show_source, routing_rules)
             reload_config()
             await event.reply(f"✅ Removed source channel: {ch} (Saved to config.json!)")
         else:
@@ -344,7 +530,7 @@ async def admin_commands(event):
                     await event.reply(f"User ID {new_admin} is already an admin.")
                 else:
                     admin_ids.add(new_admin)
-                    save_config(source_channels, destination_channels, admin_ids, show_source)
+                    save_config(source_channels, destination_channels, admin_ids, show_source, routing_rules)
                     reload_config()
                     await event.reply(f"✅ Added admin by reply: `{new_admin}` (Saved to config.json)")
         else:
@@ -356,7 +542,7 @@ async def admin_commands(event):
                         await event.reply(f"User ID {new_admin} is already an admin.")
                     else:
                         admin_ids.add(new_admin)
-                        save_config(source_channels, destination_channels, admin_ids, show_source)
+                        save_config(source_channels, destination_channels, admin_ids, show_source, routing_rules)
                         reload_config()
                         await event.reply(f"✅ Added admin: `{new_admin}` (Saved to config.json)")
                 except Exception:
@@ -376,7 +562,7 @@ async def admin_commands(event):
                     await event.reply("❌ At least one admin must remain.")
                 else:
                     admin_ids.remove(remove_admin)
-                    save_config(source_channels, destination_channels, admin_ids, show_source)
+                    save_config(source_channels, destination_channels, admin_ids, show_source, routing_rules)
                     reload_config()
                     await event.reply(f"✅ Removed admin by reply: `{remove_admin}` (Saved to config.json)")
         else:
@@ -390,7 +576,7 @@ async def admin_commands(event):
                         await event.reply("❌ At least one admin must remain.")
                     else:
                         admin_ids.remove(remove_admin)
-                        save_config(source_channels, destination_channels, admin_ids, show_source)
+                        save_config(source_channels, destination_channels, admin_ids, show_source, routing_rules)
                         reload_config()
                         await event.reply(f"✅ Removed admin: `{remove_admin}` (Saved to config.json)")
                 except Exception:
@@ -424,7 +610,7 @@ async def admin_commands(event):
         parts = cmd.split()
         if len(parts) == 2 and parts[1] in ("on", "off"):
             show_source = (parts[1] == "on")
-            save_config(source_channels, destination_channels, admin_ids, show_source)
+            save_config(source_channels, destination_channels, admin_ids, show_source, routing_rules)
             reload_config()
             await event.reply(f"✅ Source tag in forwarded messages is now {'ON' if show_source else 'OFF'}.")
         else:
@@ -443,6 +629,10 @@ async def admin_commands(event):
             "/adddest <channel username or id>\n"
             "/removedest <channel username or id>\n"
             "/setdest <ch1,ch2,...>  - full replace\n"
+            "/addroute <dest> <kw1,kw2,...|*> [from src1,src2]\n"
+            "/addregex <dest> <pattern> [from src1,src2]\n"
+            "/removeroute <route id>\n"
+            "/routes - List routing rules\n"
             "/showsource on|off - Toggle 'Source:' in forwards\n"
             "/addadmin <user_id> or reply to user\n"
             "/removeadmin <user_id> or reply to user\n"
@@ -471,11 +661,20 @@ async def admin_commands(event):
             "Sources:\n" + "\n".join(pretty_sources) +
             "\nDestinations:\n" + "\n".join(pretty_dests) +
             f"\nAdmins: {list(admin_ids)}\nShow source tag: {show_source}"
+            f"\nRouting rules: {len(routing_rules)}"
         )
     else:
         await event.reply("❓ Unknown command. Type /help.")
 
 async def main():
+    global local_queue, bot_server
+    if FORWARD_TRANSPORT == "local":
+        # Single-process mode: the Bot API sender runs on this event loop.
+        # The queue must exist before the client starts dispatching messages.
+        import bot_server
+        local_queue = asyncio.Queue()
+        await bot_server.refresh_dest_channels()
+        asyncio.create_task(bot_server.consume_queue(local_queue))
     await client.start()
     await client.run_until_disconnected()
 
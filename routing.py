@@ -0,0 +1,215 @@
+import re
+import logging
+from collections import deque
+
+
+class KeywordIndex:
+    """Aho-Corasick automaton over lowercase keywords.
+
+    Every keyword is tagged with the ids of the rules that own it, so one pass
+    over a caption returns all rules with at least one keyword hit. Adding or
+    removing a keyword only touches its own path in the trie (dead leaves are
+    pruned and their slots reused), but any change to the set of keywords
+    marks the failure links dirty, and they are rebuilt with one pass over the
+    whole trie on the next search.
+    """
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._link = [0]  # nearest proper suffix node that ends a keyword
+        self._out = [set()]
+        self._terminal = [False]
+        self._free = []  # slots of pruned nodes, reused by add()
+        self._dirty = False
+
+    def _new_node(self):
+        if self._free:
+            return self._free.pop()
+        self._goto.append({})
+        self._fail.append(0)
+        self._link.append(0)
+        self._out.append(set())
+        self._terminal.append(False)
+        return len(self._goto) - 1
+
+    def add(self, keyword, owner):
+        node = 0
+        for ch in keyword:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = self._new_node()
+                self._goto[node][ch] = nxt
+                self._dirty = True
+            node = nxt
+        if not self._terminal[node]:
+            self._terminal[node] = True
+            self._dirty = True
+        self._out[node].add(owner)
+
+    def remove(self, keyword, owner):
+        path = [0]
+        for ch in keyword:
+            node = self._goto[path[-1]].get(ch)
+            if node is None:
+                return
+            path.append(node)
+        node = path[-1]
+        self._out[node].discard(owner)
+        if self._out[node] or not self._terminal[node]:
+            return
+        self._terminal[node] = False
+        self._dirty = True
+        # Prune the now-dead tail of the path back to the last shared node
+        for depth in range(len(keyword), 0, -1):
+            node = path[depth]
+            if self._goto[node] or self._terminal[node]:
+                break
+            del self._goto[path[depth - 1]][keyword[depth - 1]]
+            self._fail[node] = self._link[node] = 0
+            self._free.append(node)
+
+    def _build_links(self):
+        queue = deque()
+        for nxt in self._goto[0].values():
+            self._fail[nxt] = 0
+            self._link[nxt] = 0
+            queue.append(nxt)
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                f = self._goto[f].get(ch, 0)
+                self._fail[nxt] = f
+                self._link[nxt] = f if self._terminal[f] else self._link[f]
+                queue.append(nxt)
+        self._dirty = False
+
+    def search(self, text):
+        if self._dirty:
+            self._build_links()
+        goto, fail, link, out = self._goto, self._fail, self._link, self._out
+        found = set()
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            hit = node
+            while hit:
+                if out[hit]:
+                    found |= out[hit]
+                hit = link[hit]
+        return found
+
+
+class RouteIndex:
+    """Maps (source, caption) to the destinations whose routing rules match.
+
+    A rule looks like the entries of ``routing_rules`` in config.json::
+
+        {"id": 1, "dest": "-100...", "sources": ["-100..."],
+         "keywords": ["btc", "etf"], "regex": ["\\$\\d+[mb]"]}
+
+    Empty ``sources`` means any source. A rule with keywords or regex matches
+    when any of them hits; a rule with neither matches on source alone.
+    Keywords are case-insensitive substrings. A malformed rule never matches,
+    but still counts towards ``ruled_dests`` so its destination fails closed.
+    """
+
+    def __init__(self):
+        self._keywords = KeywordIndex()
+        self._rules = {}
+        self._regex_cache = {}
+
+    def _compile(self, pattern):
+        if pattern not in self._regex_cache:
+            self._regex_cache[pattern] = re.compile(pattern, re.IGNORECASE)
+        return self._regex_cache[pattern]
+
+    @staticmethod
+    def validate_rule(rule):
+        """Return a description of what is wrong with ``rule``, or None."""
+        if not isinstance(rule.get("dest"), (str, int)) or isinstance(rule.get("dest"), bool):
+            return "dest must be a channel id"
+        for field in ("sources", "keywords", "regex"):
+            value = rule.get(field)
+            if value is not None and not (isinstance(value, list) and all(isinstance(v, str) for v in value)):
+                return f"{field} must be a list of strings"
+        return None
+
+    @classmethod
+    def _normalize(cls, rid, rule):
+        error = cls.validate_rule(rule)
+        if error:
+            logging.error(f"Routing rule {rid} never matches: {error}")
+            return {"dest": str(rule.get("dest")), "sources": frozenset(), "keywords": (), "regex": (), "invalid": True}
+        return {
+            "dest": str(rule.get("dest")),
+            "sources": frozenset(str(s) for s in rule.get("sources") or []),
+            "keywords": tuple(sorted({k.lower() for k in rule.get("keywords") or [] if k})),
+            "regex": tuple(rule.get("regex") or []),
+            "invalid": False,
+        }
+
+    def _add(self, rid, rule):
+        compiled = []
+        for pattern in rule["regex"]:
+            try:
+                compiled.append(self._compile(pattern))
+            except re.error as e:
+                # The rule stays so its dest remains ruled; the pattern never matches
+                logging.error(f"Routing rule {rid}: ignoring bad regex {pattern!r}: {e}")
+        for kw in rule["keywords"]:
+            self._keywords.add(kw, rid)
+        self._rules[rid] = dict(rule, compiled=compiled)
+
+    def _remove(self, rid):
+        rule = self._rules.pop(rid)
+        for kw in rule["keywords"]:
+            self._keywords.remove(kw, rid)
+
+    def sync(self, rules):
+        """Bring the index in line with ``rules``, touching only changed ones."""
+        wanted = {}
+        for idx, rule in enumerate(rules):
+            rid = rule.get("id")
+            if rid is None or rid in wanted:
+                # Keep the rule under a positional key rather than overwrite another one
+                logging.error(f"Routing rule #{idx + 1} has a missing or duplicate id ({rid}); indexing it by position.")
+                rid = ("pos", idx)
+            wanted[rid] = self._normalize(rid, rule)
+        for rid in list(self._rules):
+            old = self._rules[rid]
+            new = wanted.get(rid)
+            if new is None or any(old[k] != new[k] for k in new):
+                self._remove(rid)
+        for rid, rule in wanted.items():
+            if rid not in self._rules:
+                self._add(rid, rule)
+        in_use = {p for r in self._rules.values() for p in r["regex"]}
+        for pattern in list(self._regex_cache):
+            if pattern not in in_use:
+                del self._regex_cache[pattern]
+
+    @property
+    def ruled_dests(self):
+        return {r["dest"] for r in self._rules.values()}
+
+    def match(self, source_id, text):
+        source_id = str(source_id)
+        text = text or ""
+        hits = self._keywords.search(text.lower()) if text else set()
+        dests = set()
+        for rid, rule in self._rules.items():
+            if rule["dest"] in dests or rule["invalid"]:
+                continue
+            if rule["sources"] and source_id not in rule["sources"]:
+                continue
+            if rule["keywords"] or rule["regex"]:
+                if rid not in hits and not any(p.search(text) for p in rule["compiled"]):
+                    continue
+            dests.add(rule["dest"])
+        return dests
@@ -0,0 +1,68 @@
+import random
+
+from routing import KeywordIndex, RouteIndex
+
+
+def naive_search(live, text):
+    found = set()
+    for keyword, owners in live.items():
+        if keyword in text:
+            found |= owners
+    return found
+
+
+def test_keyword_index_matches_naive_search():
+    rng = random.Random(1234)
+    index = KeywordIndex()
+    live = {}
+    for _ in range(5000):
+        keyword = "".join(rng.choice("abc") for _ in range(rng.randint(1, 4)))
+        owner = rng.randint(0, 3)
+        if rng.random() < 0.5:
+            index.add(keyword, owner)
+            live.setdefault(keyword, set()).add(owner)
+        else:
+            index.remove(keyword, owner)
+            live.get(keyword, set()).discard(owner)
+        text = "".join(rng.choice("abcd") for _ in range(rng.randint(0, 12)))
+        assert index.search(text) == naive_search(live, text), (keyword, text)
+
+
+def test_keyword_index_prunes_and_reuses_nodes():
+    index = KeywordIndex()
+    index.add("abcd", 1)
+    index.add("ab", 2)
+    size = len(index._goto)
+    index.remove("abcd", 1)
+    assert index.search("abcd") == {2}
+    index.add("abxy", 3)
+    assert len(index._goto) == size
+    assert index.search("zabxy") == {2, 3}
+
+
+def test_route_index_keywords_regex_and_sources():
+    index = RouteIndex()
+    index.sync([
+        {"id": 1, "dest": "-1", "keywords": ["BTC", "etf"]},
+        {"id": 2, "dest": "-2", "sources": ["s1"], "regex": [r"\$\d+m"]},
+        {"id": 3, "dest": "-3", "sources": ["s2"]},
+    ])
+    assert index.match("s1", "Spot ETF pulls $5M") == {"-1", "-2"}
+    assert index.match("s3", "Spot ETF pulls $5M") == {"-1"}
+    assert index.match("s2", "") == {"-3"}
+    index.sync([{"id": 1, "dest": "-1", "keywords": ["eth"]}])
+    assert index.match("s1", "btc and eth") == {"-1"}
+    assert index.ruled_dests == {"-1"}
+
+
+def test_route_index_fails_closed_on_bad_rules():
+    index = RouteIndex()
+    index.sync([
+        {"id": 1, "dest": "-1", "regex": ["("]},
+        {"id": 2, "dest": "-2", "keywords": "btc"},
+        {"id": 3, "dest": "-3", "keywords": ["btc", 5]},
+        {"dest": "-4", "keywords": ["a"]},
+        {"dest": "-5", "keywords": ["zzz"]},
+    ])
+    assert index.ruled_dests == {"-1", "-2", "-3", "-4", "-5"}
+    assert index.match("s", "a talk about btc (") == {"-4"}
@@ -0,0 +1,183 @@
+import os
+import json
+import stat
+import struct
+import asyncio
+import logging
+
+# Framed protocol used over the Unix domain socket:
+#   u32 header length | JSON header | (u32 blob length | blob bytes) * n
+# Media travels as raw bytes instead of base64 inside the JSON. Instead of
+# the per-request secret key, the server creates the socket 0600 and the
+# sender refuses sockets owned by another user.
+LEN = struct.Struct("!I")
+ACK = b"\x01"
+SEND_TIMEOUT = 30  # seconds, same as the HTTP transport
+QUEUE_SIZE = 8  # acked frames buffered per connection before the sender is held back
+CLOSE_TIMEOUT = 30  # seconds to finish acked frames on shutdown
+
+# Shared by forwarder.py and bot_server.py when FORWARD_SOCKET is not set.
+# Both directories are private to the user, unlike /tmp.
+DEFAULT_SOCKET = os.path.join(
+    os.environ.get("XDG_RUNTIME_DIR") or os.path.dirname(os.path.abspath(__file__)),
+    "tg_forwarder.sock",
+)
+
+
+def split_media(payload):
+    """Pull raw media bytes out of a payload, leaving a JSON-safe header."""
+    header = dict(payload)
+    blobs = []
+    if isinstance(header.get("media_bytes"), bytes):
+        blobs.append(header.pop("media_bytes"))
+        header["media_blob"] = True
+    if header.get("media_bytes_list"):
+        album = header.pop("media_bytes_list")
+        blobs.extend(album)
+        header["media_blob_count"] = len(album)
+    return header, blobs
+
+
+def encode_frame(payload):
+    header, blobs = split_media(payload)
+    head = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    parts = [LEN.pack(len(head)), head]
+    for blob in blobs:
+        parts.append(LEN.pack(len(blob)))
+        parts.append(blob)
+    return b"".join(parts)
+
+
+async def read_frame(reader):
+    (size,) = LEN.unpack(await reader.readexactly(LEN.size))
+    payload = json.loads(await reader.readexactly(size))
+
+    async def blob():
+        (n,) = LEN.unpack(await reader.readexactly(LEN.size))
+        return await reader.readexactly(n)
+
+    if payload.pop("media_blob", False):
+        payload["media_bytes"] = await blob()
+    count = payload.pop("media_blob_count", 0)
+    if count:
+        payload["media_bytes_list"] = [await blob() for _ in range(count)]
+    return payload
+
+
+class UnixSocketSender:
+    """Keeps one connection to the bot server socket and reconnects on failure."""
+
+    def __init__(self, path):
+        self.path = path
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+
+    async def _connect(self):
+        st = os.lstat(self.path)
+        if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+            raise PermissionError(f"{self.path} is not a socket owned by this user")
+        self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+
+    def close(self):
+        if self._writer:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def send(self, payload):
+        frame = encode_frame(payload)
+        async with self._lock:
+            try:
+                if self._writer is None:
+                    await self._connect()
+                self._writer.write(frame)
+                await asyncio.wait_for(self._writer.drain(), SEND_TIMEOUT)
+                await asyncio.wait_for(self._reader.readexactly(1), SEND_TIMEOUT)
+            except Exception:
+                self.close()
+                raise
+
+
+class UnixSocketServer:
+    """Serves framed payloads on ``path``; ``handler`` is awaited for each one.
+
+    Frames are handled in order by a per-connection worker. A frame is only
+    acked once it fits in that worker's bounded queue, so a slow handler holds
+    the sender back instead of piling up media in memory. close() gives the
+    workers time to finish what was acked and returns how many were dropped.
+    """
+
+    def __init__(self, path, handler, queue_size=QUEUE_SIZE):
+        self.path = path
+        self.handler = handler
+        self.queue_size = queue_size
+        self.pending = 0  # acked but not yet handled
+        self._server = None
+        self._workers = {}  # worker task -> its queue
+        self._clients = set()
+        self._writers = set()
+
+    async def start(self):
+        if os.path.lexists(self.path):
+            if not stat.S_ISSOCK(os.lstat(self.path).st_mode):
+                raise RuntimeError(f"{self.path} exists and is not a socket, refusing to replace it")
+            os.remove(self.path)
+        old_umask = os.umask(0o177)  # socket is created 0600, no chmod race
+        try:
+            self._server = await asyncio.start_unix_server(self._on_client, path=self.path)
+        finally:
+            os.umask(old_umask)
+
+    async def _worker(self, queue):
+        while True:
+            payload = await queue.get()
+            if payload is None:
+                return
+            try:
+                await self.handler(payload)
+            except Exception as e:
+                logging.error(f"[SOCKET] Handler failed: {e}")
+            finally:
+                self.pending -= 1
+
+    async def _on_client(self, reader, writer):
+        queue = asyncio.Queue(self.queue_size)
+        task = asyncio.create_task(self._worker(queue))
+        self._workers[task] = queue
+        self._clients.add(asyncio.current_task())
+        self._writers.add(writer)
+        try:
+            while True:
+                payload = await read_frame(reader)
+                await queue.put(payload)
+                self.pending += 1
+                writer.write(ACK)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+        await queue.put(None)  # finish what was already acked
+        await asyncio.wait([task])
+        self._workers.pop(task, None)
+        self._clients.discard(asyncio.current_task())
+
+    async def close(self, timeout=CLOSE_TIMEOUT):
+        """Stop serving, wait for acked frames, and return how many were dropped."""
+        if self._server:
+            self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+        if self._workers:
+            await asyncio.wait(list(self._workers), timeout=timeout)
+        dropped = self.pending
+        for task, queue in list(self._workers.items()):
+            task.cancel()
+            while not queue.empty():  # unblock the connection's final put
+                queue.get_nowait()
+        if self._clients:
+            await asyncio.wait(list(self._clients), timeout=1)
+        if os.path.lexists(self.path) and stat.S_ISSOCK(os.lstat(self.path).st_mode):
+            os.remove(self.path)
+        return dropped